@@ -83,7 +83,7 @@ export class DocProcessingStack extends cdk.Stack {
     const package_layer = new lambda.LayerVersion(this, 'PackageLayer', {
       code: lambda.Code.fromAsset('lib/lambda-layers/package-layer.zip'), 
       compatibleRuntimes: [lambda.Runtime.PYTHON_3_9],
-      description: 'A layer containing python-docx, mammoth and beautiful soup',
+      description: 'A layer containing python-docx, mammoth, beautiful soup and the shared profiling module',
     });
 
     // Translate Lambda function
@@ -94,11 +94,16 @@ export class DocProcessingStack extends cdk.Stack {
       layers: [package_layer],
       environment: {
         INPUT_BUCKET: inputBucket.bucketName,
+        OUTPUT_BUCKET: outputBucket.bucketName,
       },
       timeout: cdk.Duration.minutes(3),
       reservedConcurrentExecutions: 1,
     });
 
+    // Number of documents the Bedrock lambda processes at the same time. python-docx, mammoth and
+    // BeautifulSoup each hold a copy of a document, so memory is sized per concurrent document
+    const bedrockBatchConcurrency = 4;
+
     // Bedrock Lambda function
     const bedrockLambda = new lambda.Function(this, 'bedrockLambda', {
       runtime: lambda.Runtime.PYTHON_3_9,
@@ -108,8 +113,14 @@ export class DocProcessingStack extends cdk.Stack {
       environment: {
         OUTPUT_BUCKET: outputBucket.bucketName,
         INPUT_BUCKET: inputBucket.bucketName,
+        BATCH_CONCURRENCY: String(bedrockBatchConcurrency),
+        BATCH_TIME_RESERVE_SECONDS: '240',
+        VERIFY_RETRY_BUDGET: '3',
       },
-      timeout: cdk.Duration.minutes(10),
+      memorySize: 256 * bedrockBatchConcurrency,
+      // One invocation processes all documents of an upload; documents not started with
+      // BATCH_TIME_RESERVE_SECONDS left are reported as failed instead of timing out
+      timeout: cdk.Duration.minutes(15),
     });
 
     // Aggregate Lambda function
@@ -133,6 +144,7 @@ export class DocProcessingStack extends cdk.Stack {
     // Permission to read and write S3 buckets
     inputBucket.grantReadWrite(createS3foldersLambda);
     inputBucket.grantReadWrite(translateLambda);
+    outputBucket.grantReadWrite(translateLambda);
     inputBucket.grantRead(bedrockLambda);
     outputBucket.grantReadWrite(bedrockLambda);
 
@@ -159,14 +171,19 @@ export class DocProcessingStack extends cdk.Stack {
       outputPath: '$.Payload',
     });
 
+    // All documents of an upload (the original and its translations) go to one invocation
     const bedrockLambdaTask = new tasks.LambdaInvoke(this, 'Invoke Bedrock Processing Lambda', {
       lambdaFunction: bedrockLambda,
+      payload: sfn.TaskInput.fromObject({
+        paths: sfn.JsonPath.listAt('$.parsedBody.body.filePaths'),
+      }),
+      resultPath: '$.bedrockResult',
     });
 
     const aggregateResultsTask = new tasks.LambdaInvoke(this, 'Aggregate Results', {
       lambdaFunction: aggregationLambda,
       payload: sfn.TaskInput.fromObject({
-        mapResults: sfn.JsonPath.stringAt('$.mapResults')
+        mapResults: sfn.JsonPath.array(sfn.JsonPath.stringAt('$.bedrockResult'))
       }),
       outputPath: '$.Payload',
     });
@@ -188,17 +205,28 @@ export class DocProcessingStack extends cdk.Stack {
       resultPath: '$.parsedBody',
     });
 
-    const mapState = new sfn.Map(this, 'Process Docs', {
-      maxConcurrency: 1,
+    // If the invocation itself fails (e.g. out of memory or timeout), report every document as failed
+    const batchFailed = new sfn.Map(this, 'Batch Failed', {
       itemsPath: sfn.JsonPath.stringAt('$.parsedBody.body.filePaths'),
-      resultPath: '$.mapResults',
-    }).itemProcessor(
-      bedrockLambdaTask.next(
-        new sfn.Choice(this, 'Did Lambda Succeed?')
-          .when(sfn.Condition.numberEquals('$.Payload.statusCode', 200), new sfn.Pass(this, 'Lambda Success'))
-          .otherwise(new sfn.Pass(this, 'Lambda Failure'))
-      )
+      itemSelector: {
+        statusCode: 500,
+        'body.$': "States.Format('Could not process {} because the Bedrock lambda failed: {}', $$.Map.Item.Value.path, $.bedrockError.Error)",
+      },
+      resultPath: '$.bedrockResult.Payload.results',
+    }).itemProcessor(new sfn.Pass(this, 'Document Failed'));
+
+    bedrockLambdaTask.addCatch(batchFailed, { resultPath: '$.bedrockError' });
+
+    // The batch returns 200 only if every document in it was processed
+    const processDocs = bedrockLambdaTask.next(
+      new sfn.Choice(this, 'Did Batch Succeed?')
+        .when(sfn.Condition.numberEquals('$.bedrockResult.Payload.statusCode', 200), new sfn.Pass(this, 'Batch Success'))
+        .otherwise(new sfn.Pass(this, 'Batch Failure'))
+        .afterwards()
+        .next(aggregateResultsTask)
     );
+    batchFailed.next(aggregateResultsTask);
+    aggregateResultsTask.next(publishResultsTask);
 
     // Update when adding / changing languages
     const exitPaths = ['english/', 'spanish/','french/'];
@@ -213,13 +241,7 @@ export class DocProcessingStack extends cdk.Stack {
       translateTask.next(
         new sfn.Choice(this, 'Did Translate Succeed?')
           .when(sfn.Condition.numberEquals('$.statusCode', 200), 
-            parseBody.next(
-              mapState.next(
-                aggregateResultsTask.next(
-                  publishResultsTask
-                )
-              )
-            )
+            parseBody.next(processDocs)
           )
           .otherwise(publishResultsTask)
       )
@@ -232,7 +254,8 @@ export class DocProcessingStack extends cdk.Stack {
 
     const stateMachine = new sfn.StateMachine(this, 'DocProcessingStateMachine', {
       definitionBody: DefinitionBody.fromChainable(definition),
-      timeout: cdk.Duration.minutes(10),
+      // Longest path: translate (3 minutes), the Bedrock lambda (15 minutes), aggregation and SNS
+      timeout: cdk.Duration.minutes(20),
       logs: {
         destination: sfnLogGroup,
         level: sfn.LogLevel.ALL,
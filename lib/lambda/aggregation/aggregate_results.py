@@ -24,7 +24,10 @@ def handler(event, context):
         failure_docs = []
         
         map_results = event.get('mapResults', []) 
-        payloads = [result['Payload'] for result in map_results]
+        payloads = []
+        for result in map_results:
+            # Batch invocations of the bedrock lambda return one result per document
+            payloads.extend(result['Payload'].get('results', [result['Payload']]))
         for payload in payloads:
             status_code = payload['statusCode']
             body = payload['body']
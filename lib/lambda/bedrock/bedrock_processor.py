@@ -7,6 +7,10 @@ from botocore.config import Config
 import os
 from docx import Document
 from claude_prompt import get_claude_prompt
+from profiling import document, profiled, stage
+from structure_verifier import StructureProblem, verify_structure
+from section_cache import (split_sections, split_like, sections_match, section_hash, renumber_placeholders,
+                           load_manifest, save_manifest)
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
 import docx.oxml.shared
@@ -14,13 +18,23 @@ from docx.opc.constants import RELATIONSHIP_TYPE
 import mammoth
 from bs4 import BeautifulSoup
 from docx.shared import Pt
-import zipfile
+from docx.text.run import Run
+import copy
+import hashlib
+import re
 import tempfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 
+# Number of documents processed concurrently in batch mode
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '4'))
+# Documents are not started in batch mode once less than this is left of the invocation
+BATCH_TIME_RESERVE_SECONDS = int(os.environ.get('BATCH_TIME_RESERVE_SECONDS', '240'))
+
 # Initialize S3 client
-config = Config(connect_timeout=5, read_timeout=60, retries={"total_max_attempts": 20, "mode": "adaptive"})
+config = Config(connect_timeout=5, read_timeout=60, retries={"total_max_attempts": 20, "mode": "adaptive"},
+                max_pool_connections=max(10, BATCH_CONCURRENCY * 2))
 s3_client = boto3.client('s3', config=config)
 
 # Bedrock config
@@ -31,60 +45,163 @@ bedrock = boto3.client(
     endpoint_url=f'https://bedrock-runtime.{region}.amazonaws.com',
     config=config)
 
+# Image placeholders
+PLACEHOLDER_PATTERN = re.compile(r'(\[IMAGE_\d+\])')
+IMAGE_NAMESPACES = {
+    'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+    'v': 'urn:schemas-microsoft-com:vml',
+    'mc': 'http://schemas.openxmlformats.org/markup-compatibility/2006',
+}
+DRAWING_TAG = qn('w:drawing')
+PICT_TAG = qn('w:pict')
+CHOICE_TAG = f"{{{IMAGE_NAMESPACES['mc']}}}Choice"
+
+REFERENCE_KEY = 'word_template.docx'
+
+# Using Claude 3 Sonnet (update as needed)
+MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1:0"
+MAX_TOKENS = 5000
+
+# Number of failing sections that may be requested again per document
+VERIFY_RETRY_BUDGET = int(os.environ.get('VERIFY_RETRY_BUDGET', '3'))
+
+# Per-document manifests of processed sections, stored in the output bucket
+MANIFEST_PREFIX = 'manifests/bedrock/'
+# Cached sections are only reused with the prompt and model that produced them
+MANIFEST_FINGERPRINT = hashlib.sha256(f'{MODEL_ID}:{MAX_TOKENS}:{get_claude_prompt("")}'.encode('utf-8')).hexdigest()
+
+@profiled('bedrock_processor')
 def handler(event, context):
-    try:
-        # Retrieve bucket name and document key from the event object
-        bucket_name = os.environ['INPUT_BUCKET']  
-        document_key = event['path']  
-        reference_key = 'word_template.docx'  
-        output_bucket = os.environ['OUTPUT_BUCKET']
-  
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_input:
-            local_input_path = temp_input.name
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_reference:
-            local_reference_path = temp_reference.name
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_output:
-            local_output_path_docx = temp_output.name
-        
-        # Create a temporary directory
-        tmp_dir = tempfile.mkdtemp(prefix='output_images_')
-        
+    # A batch event carries a list of paths, a single-document event carries one path
+    if 'paths' in event:
+        return process_batch(event['paths'], context)
 
-        # Download the DOCX file from S3 to the local path
-        s3_client.download_file(bucket_name, document_key, local_input_path)
+    document_key = event.get('path')
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_reference:
+        local_reference_path = temp_reference.name
 
+    try:
         # Download the reference template from S3 to the local path
-        s3_client.download_file(bucket_name, reference_key, local_reference_path)
+        s3_client.download_file(os.environ['INPUT_BUCKET'], REFERENCE_KEY, local_reference_path)
+        with document(document_key):
+            return process_document(document_key, local_reference_path)
+    except Exception as e:
+        print(f'Error: {str(e)}')
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f'Could not process {document_key} due to the following error: {str(e)}')
+        }
+    finally:
+        os.unlink(local_reference_path)
+
+
+def process_batch(paths, context=None):
+    """Process several documents in one invocation, overlapping their S3 and Bedrock calls.
+
+    Each entry is either an S3 key or a Map item with a 'path' key. Results are returned in
+    input order, one per document, in the same shape the single-document handler returns.
+    The batch has status 200 only if every document succeeded.
+    """
+    document_keys = [path['path'] if isinstance(path, dict) else path for path in paths]
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_reference:
+        local_reference_path = temp_reference.name
+
+    try:
+        # The template is downloaded once and shared (read-only) by every document in the batch
+        s3_client.download_file(os.environ['INPUT_BUCKET'], REFERENCE_KEY, local_reference_path)
+
+        with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+            futures = [executor.submit(_process_before_deadline, key, local_reference_path, context)
+                       for key in document_keys]
+
+        results = []
+        for document_key, future in zip(document_keys, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f'Error processing {document_key}: {str(e)}')
+                results.append({
+                    'statusCode': 500,
+                    'body': json.dumps(f'Could not process {document_key} due to the following error: {str(e)}')
+                })
+    except Exception as e:
+        print(f'Error: {str(e)}')
+        results = [{
+            'statusCode': 500,
+            'body': json.dumps(f'Could not process {document_key} due to the following error: {str(e)}')
+        } for document_key in document_keys]
+    finally:
+        os.unlink(local_reference_path)
+
+    succeeded = sum(1 for result in results if result['statusCode'] == 200)
+    print(f"Processed batch of {len(results)} documents, {succeeded} succeeded")
+
+    return {
+        'statusCode': 200 if succeeded == len(results) else 500,
+        'body': f'{succeeded} of {len(results)} documents processed',
+        'results': results
+    }
+
+
+def _process_before_deadline(document_key, local_reference_path, context):
+    """Process a batch document, unless too little time is left in the invocation to finish it."""
+    if context is not None and context.get_remaining_time_in_millis() < BATCH_TIME_RESERVE_SECONDS * 1000:
+        raise TimeoutError(f'not started, less than {BATCH_TIME_RESERVE_SECONDS} seconds left in the invocation')
+    # Profiled stages run on this worker thread are labelled with the document
+    with document(document_key):
+        return process_document(document_key, local_reference_path)
+
+
+def process_document(document_key, local_reference_path):
+    """Correct a single document with Bedrock and upload it to the output bucket."""
+    bucket_name = os.environ['INPUT_BUCKET']
+    output_bucket = os.environ['OUTPUT_BUCKET']
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_input:
+        local_input_path = temp_input.name
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_output:
+        local_output_path_docx = temp_output.name
+
+    # Create a temporary directory
+    tmp_dir = tempfile.mkdtemp(prefix='output_images_')
+
+    try:
+        # Download the DOCX file from S3 to the local path
+        with stage('download'):
+            s3_client.download_file(bucket_name, document_key, local_input_path)
 
         # Extract images and replace them with placeholders
-        images_info = extract_images_and_replace_with_placeholders(local_input_path, tmp_dir)
+        with stage('extract_images'):
+            images_info = extract_images_and_replace_with_placeholders(local_input_path, tmp_dir)
         
         #Convert DOCX to HTML using Mammoth
-        html_content = docx_to_html(local_input_path)
+        with stage('docx_to_html'):
+            html_content = docx_to_html(local_input_path, images_info, tmp_dir)
         
-        # Retrieve prompt from claude_prompt.py
-        model_prompt = get_claude_prompt(html_content)
-
-        # Send HTML to model for processing
-        corrected_text = invoke_bedrock_model(model_prompt)
+        # Send HTML to model for processing, reusing sections unchanged since the last run
+        with stage('invoke_bedrock_model'):
+            corrected_text, verification = correct_html_incrementally(document_key, html_content)
 
         # loading template and transforming HTML back to DOCX
-        load_template_and_add_html_content(local_reference_path, local_output_path_docx, corrected_text)
+        with stage('html_to_docx'):
+            load_template_and_add_html_content(local_reference_path, local_output_path_docx, corrected_text)
 
         # reinstering images that were removed
-        reinsert_images(local_output_path_docx, images_info)
+        with stage('reinsert_images'):
+            reinsert_images(local_output_path_docx, images_info)
         
-        # Load the corrected Word document
-        doc = Document(local_output_path_docx)
+        with stage('center_images'):
+            # Load the corrected Word document
+            doc = Document(local_output_path_docx)
 
-        # Center all images in the document
-        center_images(doc)
+            # Center all images in the document
+            center_images(doc)
 
-        # Save the modified document
-        doc.save(local_output_path_docx)
+            # Save the modified document
+            doc.save(local_output_path_docx)
 
         if document_key.endswith("_translated.docx"):
             final_doc_name = document_key.replace('_translated.docx', '_corrected.docx')
@@ -93,28 +210,21 @@ def handler(event, context):
         
         
         # Upload the corrected Word document to the specified output S3 bucket
-        with open(local_output_path_docx, 'rb') as f:
+        with stage('upload'), open(local_output_path_docx, 'rb') as f:
             s3_client.upload_fileobj(f, output_bucket, final_doc_name)
-
-
+    finally:
         # Clean up temporary files
         os.unlink(local_input_path)
-        os.unlink(local_reference_path)
         os.unlink(local_output_path_docx)
 
         # Clean up temporary directory
         shutil.rmtree(tmp_dir)
 
-        return {
-            'statusCode': 200,
-            'body': final_doc_name
-        }
-    except Exception as e:
-        print(f'Error: {str(e)}')
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f'Could not process {document_key} due to the following error: {str(e)}')
-        }
+    return {
+        'statusCode': 200,
+        'body': final_doc_name,
+        'verification': verification
+    }
     
 
 ## Functions used above##
@@ -124,7 +234,7 @@ def invoke_bedrock_model(model_prompt):
     
     native_request = {
             "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 5000,
+            "max_tokens": MAX_TOKENS,
             "temperature": 0.0,
             "messages": [
                 {
@@ -136,18 +246,126 @@ def invoke_bedrock_model(model_prompt):
 
     body = json.dumps(native_request)
 
-    # Using Claude 3 Sonnet (update as needed)
-    modelID = "anthropic.claude-3-sonnet-20240229-v1:0"
-    
     response = bedrock.invoke_model(
         body=body,
-        modelId=modelID,
+        modelId=MODEL_ID,
     )
 
     response = json.loads(response.get("body").read())
     corrected_text = response["content"][0]["text"]
     return corrected_text
 
+def correct_html_incrementally(document_key, html_content):
+    """Correct document HTML with Bedrock, only sending sections that changed since the previous run.
+
+    Returns the corrected HTML and the verification counts for the document.
+    """
+    output_bucket = os.environ['OUTPUT_BUCKET']
+    manifest_key = f'{MANIFEST_PREFIX}{document_key}.json'
+
+    sections = split_sections(html_content)
+    previous = load_manifest(s3_client, output_bucket, manifest_key, MANIFEST_FINGERPRINT)
+
+    outputs = []
+    for section in sections:
+        cached_output = previous.get(section_hash(section))
+        outputs.append(renumber_placeholders(cached_output, section) if cached_output is not None else None)
+
+    changed = [i for i, output in enumerate(outputs) if output is None]
+    print(f"Reusing {len(sections) - len(changed)} of {len(sections)} sections from the previous run")
+
+    # Each run of consecutive changed sections goes to the model in one request
+    verification = {'verified': 0, 'retries': 0, 'failed': 0}
+    unverified = set()
+    for run in _consecutive_runs(changed):
+        results = _correct_sections([sections[i] for i in run], verification)
+        for i, (output, passed) in zip(run, results):
+            outputs[i] = output
+            if not passed:
+                unverified.add(i)
+
+    if changed:
+        print(f"Verification for {document_key}: {verification['verified']} checks, "
+              f"{verification['retries']} retries, {verification['failed']} sections left uncorrected")
+
+    manifest_sections = {
+        section_hash(section): output
+        for i, (section, output) in enumerate(zip(sections, outputs))
+        if i not in unverified
+    }
+    save_manifest(s3_client, output_bucket, manifest_key, MANIFEST_FINGERPRINT, manifest_sections)
+
+    return ''.join(outputs), verification
+
+def _correct_sections(span_sections, verification, retry_instructions=None):
+    """Correct consecutive sections in one request and verify each one against its source.
+
+    Spans of consecutive failing sections are requested again on their own, with the verifier's
+    findings added to the prompt, while the retry budget lasts. Returns an (output, passed) pair
+    per section; a section that never passes is kept uncorrected.
+    """
+    model_prompt = get_claude_prompt(''.join(span_sections), retry_instructions)
+    print(f"Prompt size: {len(model_prompt)} characters for {len(span_sections)} sections")
+    corrected_text = invoke_bedrock_model(model_prompt)
+
+    if len(span_sections) == 1:
+        corrected_sections = [corrected_text]
+    else:
+        # Pair output sections with source sections, e.g. a truncated tail leaves them empty
+        corrected_sections = [piece or None for piece in split_like(corrected_text, span_sections)]
+
+    results = [None] * len(span_sections)
+    section_problems = {}
+    for j, (section, corrected_section) in enumerate(zip(span_sections, corrected_sections)):
+        verification['verified'] += 1
+        if corrected_section is None:
+            problems = [StructureProblem('missing from the model output', 'Return the complete text, to its end.')]
+        else:
+            problems = verify_structure(section, corrected_section)
+            if not sections_match([section], [corrected_section]):
+                problems.insert(0, StructureProblem(
+                    'does not line up with the source section',
+                    'Start the output with the same block as the input and do not add, remove or merge blocks.'))
+        if problems:
+            print(f"Section failed verification ({'; '.join(problem.description for problem in problems)})")
+            section_problems[j] = problems
+        else:
+            results[j] = (corrected_section, True)
+
+    for run in _consecutive_runs(sorted(section_problems)):
+        run_sections = [span_sections[j] for j in run]
+        instructions = list(dict.fromkeys(
+            problem.instruction for j in run for problem in section_problems[j]))
+
+        if verification['retries'] >= VERIFY_RETRY_BUDGET:
+            print(f"Retry budget exhausted, keeping {len(run)} sections uncorrected")
+            retried = None
+        elif get_claude_prompt(''.join(run_sections), instructions) == model_prompt:
+            # The same request at temperature 0 would most likely fail the same way
+            print(f"Retry would repeat the previous request, keeping {len(run)} sections uncorrected")
+            retried = None
+        else:
+            verification['retries'] += 1
+            retried = _correct_sections(run_sections, verification, instructions)
+
+        if retried is None:
+            verification['failed'] += len(run)
+            retried = [(section, False) for section in run_sections]
+        for j, result in zip(run, retried):
+            results[j] = result
+
+    return results
+
+def _consecutive_runs(indices):
+    """Group sorted indices into lists of consecutive values."""
+    runs = []
+    for index in indices:
+        if runs and runs[-1][-1] == index - 1:
+            runs[-1].append(index)
+        else:
+            runs.append([index])
+    return runs
+
 def center_images(doc):
     """Center images in doc."""
     for paragraph in doc.paragraphs:
@@ -163,10 +381,41 @@ def align_paragraph_center(paragraph):
     pPr.append(jc)
 
 
-def docx_to_html(docx_path):
-    """Convert DOCX to HTML using Mammoth."""
+def _image_placeholder_hook(images_info, tmp_dir):
+    """Mammoth image hook for images extraction does not reach, e.g. in footnotes, endnotes and comments.
+
+    Each image is saved to tmp_dir and replaced with the next [IMAGE_n] placeholder, numbered after
+    the body images already in images_info, so reinsert_images puts it back.
+    """
+    def convert_image(image):
+        placeholder = f'[IMAGE_{len(images_info) + 1}]'
+        # Body images are saved as image_1..image_k with k no more than the body placeholders, so
+        # the placeholder number is free
+        image_path = os.path.join(tmp_dir, f'image_{len(images_info) + 1}.png')
+        try:
+            with image.open() as image_bytes, open(image_path, 'wb') as img_file:
+                img_file.write(image_bytes.read())
+        except Exception as e:
+            # e.g. a linked image whose file is not in the package
+            print(f"Dropping {image.content_type} image that could not be read: {str(e)}")
+            return []
+
+        print(f"Replaced {image.content_type} image outside the body with {placeholder}")
+        images_info.append({
+            "placeholder": placeholder,
+            "image_path": image_path,
+            "rel_id": None  # Not exposed by mammoth
+        })
+        return [mammoth.html.text(placeholder)]
+
+    return convert_image
+
+
+def docx_to_html(docx_path, images_info, tmp_dir):
+    """Convert DOCX to HTML using Mammoth, replacing any image left in the document with a placeholder."""
     with open(docx_path, "rb") as docx_file:      
-        html_content = mammoth.convert_to_html(docx_file).value
+        html_content = mammoth.convert_to_html(
+            docx_file, convert_image=_image_placeholder_hook(images_info, tmp_dir)).value
         print(html_content)
         return html_content
 
@@ -180,96 +429,136 @@ def _style_text(element, run):
         run.italic = True
     return run
 
+def _image_elements(body):
+    """Yield (container, rel_id) for every image mammoth would read from the body, in document order.
+
+    Covers paragraphs, tables, text boxes, content controls and grouped shapes. The container is
+    the innermost w:drawing (DrawingML) or w:pict (legacy VML) element holding the image.
+    """
+    for element in body.iter(DRAWING_TAG, PICT_TAG):
+        # Mammoth only reads the mc:Fallback branch of alternate content
+        if any(True for _ in element.iterancestors(CHOICE_TAG)):
+            continue
+        # Text-box shapes are kept; images nested in them are visited on their own
+        if element.find('.//w:txbxContent', IMAGE_NAMESPACES) is not None:
+            continue
+
+        if element.tag == DRAWING_TAG:
+            rel_ids = [blip.get(qn('r:embed')) for blip in element.iterfind('.//a:blip', IMAGE_NAMESPACES)]
+        else:
+            rel_ids = [data.get(qn('r:id')) for data in element.iterfind('.//v:imagedata', IMAGE_NAMESPACES)]
+
+        for rel_id in rel_ids:
+            if rel_id:
+                yield element, rel_id
+
+
 def extract_images_and_replace_with_placeholders(docx_file_path, tmp_dir):
     """Extract images from Word document, save them to a temporary directory, and replace with placeholders."""
     doc = Document(docx_file_path)
     images_info = []
     image_counter = 1
-    
+    stripped_bytes = 0
+
     # Ensure tmp directory exists
     os.makedirs(tmp_dir, exist_ok=True)
-    
-    # Keep track of processed relationships to avoid duplicates
-    processed_rels = set()
-
-    with zipfile.ZipFile(docx_file_path, 'r') as docx_zip:
-        for i, paragraph in enumerate(doc.paragraphs):
-            for run in paragraph.runs:
-                if 'graphic' in run.element.xml:
-                    # Find the relationship ID for this specific graphic
-                    graphic_element = run.element.find('.//a:graphic', 
-                        namespaces={'a': 'http://schemas.openxmlformats.org/drawingml/2006/main'})
-                    if graphic_element is None:
-                        continue
-                        
-                    # Get the relationship ID for this specific image
-                    blip_element = graphic_element.find('.//a:blip', 
-                        namespaces={'a': 'http://schemas.openxmlformats.org/drawingml/2006/main'})
-                    if blip_element is None:
-                        continue
-                        
-                    # Get the relationship ID (rId) for this image
-                    rel_id = blip_element.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed')
-                    
-                    # Skip if we've already processed this relationship
-                    if rel_id in processed_rels:
-                        continue
-                    processed_rels.add(rel_id)
-
-                    # Create placeholder and file path
-                    placeholder = f'[IMAGE_{image_counter}]'
-                    image_filename = f'image_{image_counter}.png'
-                    image_path = os.path.join(tmp_dir, image_filename)
-
-                    # Get the specific image using the relationship ID
-                    if rel_id in doc.part.rels:
-                        image = doc.part.rels[rel_id].target_part
-                        image_bytes = image._blob
-
-                        # Save the image to the temporary directory
-                        with open(image_path, 'wb') as img_file:
-                            img_file.write(image_bytes)
-
-                        # Store the image information
-                        images_info.append({
-                            "placeholder": placeholder,
-                            "image_path": image_path,
-                            "paragraph_index": i,
-                            "rel_id": rel_id  # Store the rel_id for debugging
-                        })
-
-                        # Replace with placeholder
-                        run.clear()
-                        run.text = placeholder
-                        
-                        image_counter += 1
+
+    # Images shared by several drawings are written to disk once
+    saved_images = {}
+    containers = []
+
+    # Materialise the list first, the tree is modified while placeholders are added
+    for container, rel_id in list(_image_elements(doc.element.body)):
+        rel = doc.part.rels.get(rel_id)
+        if rel is None or rel.is_external:
+            continue
+
+        if rel_id not in saved_images:
+            image_bytes = rel.target_part.blob
+            image_path = os.path.join(tmp_dir, f'image_{len(saved_images) + 1}.png')
+
+            # Save the image to the temporary directory
+            with open(image_path, 'wb') as img_file:
+                img_file.write(image_bytes)
+
+            saved_images[rel_id] = image_path
+            stripped_bytes += len(image_bytes)
+
+        # Every occurrence gets its own placeholder so it goes back where it was
+        placeholder = f'[IMAGE_{image_counter}]'
+        images_info.append({
+            "placeholder": placeholder,
+            "image_path": saved_images[rel_id],
+            "rel_id": rel_id  # Store the rel_id for debugging
+        })
+        image_counter += 1
+
+        # Put the placeholder text in the same run, just before the drawing
+        text = OxmlElement('w:t')
+        text.text = placeholder
+        container.addprevious(text)
+        if not containers or containers[-1] is not container:
+            containers.append(container)
+
+    # Remove the drawings now that every image inside them has a placeholder
+    for container in containers:
+        container.getparent().remove(container)
 
     # Save the modified DOCX with placeholders
     doc.save(docx_file_path)
-    
+
     # Print debug information
-    print(f"Processed {len(processed_rels)} unique images")
-    # for info in images_info:
-    #     print(f"Image: {info['image_path']}, RelID: {info['rel_id']}")
-        
+    print(f"Replaced {len(images_info)} images ({len(saved_images)} unique, {stripped_bytes} bytes) with placeholders")
+
     return images_info
 
+
+def _insert_run_after(run, paragraph):
+    """Insert an empty run with the same formatting directly after `run`."""
+    new_r = copy.deepcopy(run._r)
+    new_run = Run(new_r, paragraph)
+    new_run.clear()
+    run._r.addnext(new_r)
+    return new_run
+
+
+def _iter_all_paragraphs(container):
+    """Yield every paragraph in a document or cell, including those nested in tables."""
+    for paragraph in container.paragraphs:
+        yield paragraph
+    for table in container.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                yield from _iter_all_paragraphs(cell)
+
+
 def reinsert_images(docx_file_path, images_info):
     doc = Document(docx_file_path)
-    
+
     # Create a mapping of placeholder to image info
     placeholder_map = {info["placeholder"]: info for info in images_info}
-    
-    for paragraph in doc.paragraphs:
-        for run in paragraph.runs:
-            # Check if this run contains a placeholder
-            for placeholder, info in list(placeholder_map.items()):  
-                if placeholder in run.text:
-                    run.clear()
-                    run.add_picture(info["image_path"])
-                    # Remove this placeholder from the map to avoid reusing
-                    del placeholder_map[placeholder]
-                    break
+
+    for paragraph in _iter_all_paragraphs(doc):
+        for run in list(paragraph.runs):
+            if '[IMAGE_' not in run.text:
+                continue
+
+            # Split the run around each placeholder so surrounding text stays in place
+            pieces = PLACEHOLDER_PATTERN.split(run.text)
+            run.text = pieces[0]
+            current = run
+            for piece in pieces[1:]:
+                if not piece:
+                    continue
+                current = _insert_run_after(current, paragraph)
+                info = placeholder_map.pop(piece, None)
+                if info is not None:
+                    current.add_picture(info["image_path"])
+                else:
+                    current.text = piece
+
+    if placeholder_map:
+        print(f"Placeholders missing from model output: {', '.join(placeholder_map)}")
 
     doc.save(docx_file_path)
 
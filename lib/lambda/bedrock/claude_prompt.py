@@ -1,7 +1,13 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-def get_claude_prompt(text):
+def get_claude_prompt(text, retry_instructions=None):
+    # Rules added when the text is requested again because the previous output broke its structure
+    retry_rules = ''
+    if retry_instructions:
+        retry_rules = '\n    Your previous output for this text changed its HTML structure. Also follow these rules:' + ''.join(
+            f'\n    - {instruction}' for instruction in retry_instructions)
+
     
     prompt_template = f"""\n\nHuman: You are an AI assitant specializing in rewriting documents. You are especially good at spelling and grammar checks, and making sure documents have business-appropriate tone. 
     I will provide you with some text that you will check for spelling and grammar accuracy. You will also check to see if the document has been written in business-professional language. 
@@ -15,7 +21,7 @@ def get_claude_prompt(text):
     - Do not add any of your own text to the final output. Do not add any message along the lines of "Here is the text with spelling and grammar corrections:". You do not need to add any information about the changes you have made.
     - If a sentence is not written in a business professional tone, rewrite it without removing any information from the sentence. Changed sentences should convey all of the same information, just in a business-professional tone.
     - Return your output in the same language as the input. 
-    - Correct any translations that seem too literal and don't make sense in context.
+    - Correct any translations that seem too literal and don't make sense in context.{retry_rules}
     
     Here is the text:
 
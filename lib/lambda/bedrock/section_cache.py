@@ -0,0 +1,222 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import json
+import re
+from difflib import SequenceMatcher
+from bs4 import BeautifulSoup
+
+HEADING_TAGS = {f'h{i}' for i in range(1, 10)}
+IMAGE_PLACEHOLDER = re.compile(r'\[IMAGE_\d+\]')
+MANIFEST_VERSION = 2
+
+# Sections longer than this (in characters of HTML) are split into chunks of top-level blocks
+MAX_SECTION_CHARS = 4000
+# On average a chunk ends after every CHUNK_BOUNDARY_MODULUS blocks
+CHUNK_BOUNDARY_MODULUS = 4
+
+# Aligning model output with its source: cost of an unpaired block, and how far (in blocks, on
+# top of the difference in block count) the alignment may drift from the diagonal
+ALIGN_GAP_COST = 0.6
+ALIGN_BAND = 8
+
+
+def _top_level_blocks(html_content):
+    """Return (tag name, HTML) for the top-level elements of HTML, ignoring whitespace between them."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    return [(element.name, str(element)) for element in soup.contents if element.name is not None or element.strip()]
+
+
+def _is_chunk_boundary(block):
+    # Cut points depend only on the block itself, so an edit does not move the chunks around it
+    normalized = IMAGE_PLACEHOLDER.sub('[IMAGE]', block)
+    return hashlib.sha256(normalized.encode('utf-8')).digest()[0] % CHUNK_BOUNDARY_MODULUS == 0
+
+
+def _chunk_blocks(blocks):
+    """Split the blocks of an oversized section into chunks of at most MAX_SECTION_CHARS (one block minimum)."""
+    chunks = []
+    current = []
+    size = 0
+    for block in blocks:
+        if current and size + len(block) > MAX_SECTION_CHARS:
+            chunks.append(current)
+            current = []
+            size = 0
+        current.append(block)
+        size += len(block)
+        if _is_chunk_boundary(block):
+            chunks.append(current)
+            current = []
+            size = 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_sections(html_content):
+    """Split document HTML into sections, each starting at a top-level heading.
+
+    Sections longer than MAX_SECTION_CHARS, e.g. a document without headings, are split further
+    into chunks of whole top-level blocks.
+    """
+    groups = []
+    for name, block in _top_level_blocks(html_content):
+        if not groups or name in HEADING_TAGS:
+            groups.append([])
+        groups[-1].append(block)
+
+    sections = []
+    for blocks in groups:
+        if sum(len(block) for block in blocks) > MAX_SECTION_CHARS:
+            sections.extend(''.join(chunk) for chunk in _chunk_blocks(blocks))
+        else:
+            sections.append(''.join(blocks))
+    return sections
+
+
+def _block_words(html_content):
+    """Return (tag name, HTML, lower-case words) for the top-level blocks of HTML."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    return [
+        (element.name, str(element), str(element).lower().split() if element.name is None
+         else element.get_text(' ').lower().split())
+        for element in soup.contents if element.name is not None or element.strip()
+    ]
+
+
+def _pair_cost(source_block, output_block):
+    # Blocks of different kinds are never a correction of each other, two gaps are cheaper
+    if source_block[0] != output_block[0]:
+        return 2 * ALIGN_GAP_COST + 0.1
+    return 1 - SequenceMatcher(None, source_block[2], output_block[2], autojunk=False).ratio()
+
+
+def _align_blocks(source_blocks, output_blocks):
+    """Align output blocks with source blocks and return the source index each output block belongs to.
+
+    A banded edit-distance alignment on tag names and word similarity, so corrected text still pairs
+    with its source. Output blocks with no counterpart (e.g. a merged or added block) belong to the
+    source block before them.
+    """
+    n, m = len(source_blocks), len(output_blocks)
+    if n == 0:
+        return [0] * m
+    band = abs(n - m) + ALIGN_BAND
+    cost = {(0, 0): 0.0}
+    step = {}
+    for i in range(n + 1):
+        center = round(i * m / n)
+        for j in range(max(0, center - band), min(m, center + band) + 1):
+            if i == 0 and j == 0:
+                continue
+            options = []
+            if i > 0 and j > 0 and (i - 1, j - 1) in cost:
+                options.append((cost[(i - 1, j - 1)] + _pair_cost(source_blocks[i - 1], output_blocks[j - 1]), 'pair'))
+            if i > 0 and (i - 1, j) in cost:
+                options.append((cost[(i - 1, j)] + ALIGN_GAP_COST, 'dropped'))
+            if j > 0 and (i, j - 1) in cost:
+                options.append((cost[(i, j - 1)] + ALIGN_GAP_COST, 'added'))
+            if options:
+                cost[(i, j)], step[(i, j)] = min(options)
+
+    owners = [None] * m
+    i, j = n, m
+    while i > 0 or j > 0:
+        move = step[(i, j)]
+        if move == 'pair':
+            owners[j - 1] = i - 1
+            i, j = i - 1, j - 1
+        elif move == 'dropped':
+            i -= 1
+        else:
+            j -= 1
+
+    # Unpaired output blocks follow the block before them; a leading one goes with the first pair
+    previous = next((owner for owner in owners if owner is not None), 0)
+    for j, owner in enumerate(owners):
+        if owner is None:
+            owners[j] = previous
+        previous = owners[j]
+    return owners
+
+
+def split_like(output_html, source_sections):
+    """Split model output into one piece per source section (empty if the section got no output).
+
+    When the block counts agree the output is split block for block, otherwise its blocks are
+    aligned with the source blocks, so a merged or dropped block only affects its own section.
+    """
+    output_blocks = _block_words(output_html)
+    counts = [len(_top_level_blocks(section)) for section in source_sections]
+
+    if sum(counts) == len(output_blocks):
+        owners = list(range(len(output_blocks)))
+    else:
+        source_blocks = [block for section in source_sections for block in _block_words(section)]
+        owners = _align_blocks(source_blocks, output_blocks)
+
+    section_of_block = [k for k, count in enumerate(counts) for _ in range(count)]
+    pieces = [[] for _ in source_sections]
+    for (_, block, _), owner in zip(output_blocks, owners):
+        pieces[section_of_block[owner] if section_of_block else 0].append(block)
+    return [''.join(piece) for piece in pieces]
+
+
+def _leading_heading(section):
+    first = BeautifulSoup(section, 'html.parser').find(True, recursive=False)
+    return first.name if first is not None and first.name in HEADING_TAGS else None
+
+
+def sections_match(input_sections, output_sections):
+    """Check that model output sections line up one-to-one with the input sections."""
+    if len(input_sections) != len(output_sections):
+        return False
+    return all(_leading_heading(a) == _leading_heading(b) for a, b in zip(input_sections, output_sections))
+
+
+def section_hash(section):
+    """Hash a section's content. Image numbers are ignored so inserting an image earlier does not invalidate it."""
+    normalized = IMAGE_PLACEHOLDER.sub('[IMAGE]', section)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def renumber_placeholders(cached_output, section):
+    """Give a cached output the image placeholders of the current section, or None if they don't line up."""
+    placeholders = IMAGE_PLACEHOLDER.findall(section)
+    if len(IMAGE_PLACEHOLDER.findall(cached_output)) != len(placeholders):
+        return None
+    remaining = iter(placeholders)
+    return IMAGE_PLACEHOLDER.sub(lambda match: next(remaining), cached_output)
+
+
+def load_manifest(s3_client, bucket, key, fingerprint):
+    """Load the section hash -> processed output map of the previous run, or an empty one."""
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        manifest = json.loads(response['Body'].read())
+    except s3_client.exceptions.NoSuchKey:
+        return {}
+    except Exception as e:
+        print(f'Could not load manifest {key}: {str(e)}')
+        return {}
+
+    # Outputs produced with another prompt or model are not reused
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('fingerprint') != fingerprint:
+        return {}
+    return manifest.get('sections', {})
+
+
+def save_manifest(s3_client, bucket, key, fingerprint, sections):
+    """Store the section hash -> processed output map for the next run."""
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'fingerprint': fingerprint,
+        'sections': sections
+    }
+    try:
+        s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode('utf-8'),
+                             ContentType='application/json')
+    except Exception as e:
+        print(f'Could not save manifest {key}: {str(e)}')
@@ -0,0 +1,124 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import re
+from collections import Counter, namedtuple
+from html.parser import HTMLParser
+
+HEADING_TAGS = {f'h{i}' for i in range(1, 10)}
+LIST_TAGS = {'ul', 'ol'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+IMAGE_PLACEHOLDER = re.compile(r'\[IMAGE_\d+\]')
+
+# A structural difference, and the instruction given to the model when the text is requested again
+StructureProblem = namedtuple('StructureProblem', ['description', 'instruction'])
+
+
+class _StructureParser(HTMLParser):
+    """Single pass over the HTML collecting the structure the model must not change."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.blocks = 0
+        self.loose_text = 0
+        self.headings = []
+        self.lists = []
+        self.placeholders = []
+        self.unclosed = []
+        self.stray_end_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if not self.stack:
+            self.blocks += 1
+        if tag in HEADING_TAGS:
+            self.headings.append(tag)
+        if tag in LIST_TAGS:
+            # List type and nesting depth, e.g. ('ul', 1) for a list nested in another one
+            depth = sum(1 for open_tag in self.stack if open_tag in LIST_TAGS)
+            self.lists.append((tag, depth))
+        if tag not in VOID_TAGS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.stack:
+            self.blocks += 1
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if tag not in self.stack:
+            self.stray_end_tags.append(tag)
+            return
+        # Tags left open inside the one being closed
+        while self.stack[-1] != tag:
+            self.unclosed.append(self.stack.pop())
+        self.stack.pop()
+
+    def handle_data(self, data):
+        if not self.stack and data.strip():
+            # Text outside any block, e.g. a preamble added by the model
+            self.blocks += 1
+            self.loose_text += 1
+        self.placeholders.extend(IMAGE_PLACEHOLDER.findall(data))
+
+    def signature(self):
+        self.close()
+        return {
+            'blocks': self.blocks,
+            'loose_text': self.loose_text,
+            'headings': self.headings,
+            'lists': self.lists,
+            'placeholders': self.placeholders,
+            'unclosed': self.unclosed + self.stack,
+            'stray_end_tags': self.stray_end_tags
+        }
+
+
+def structure_signature(html_content):
+    """Return the block count, heading sequence, list nesting, image placeholders and unbalanced tags of HTML."""
+    parser = _StructureParser()
+    parser.feed(html_content)
+    return parser.signature()
+
+
+def verify_structure(source_html, output_html):
+    """Compare model output with its input and return a list of StructureProblem (empty if none)."""
+    source = structure_signature(source_html)
+    output = structure_signature(output_html)
+    problems = []
+
+    if (output['unclosed'], output['stray_end_tags']) != (source['unclosed'], source['stray_end_tags']):
+        problems.append(StructureProblem(
+            f"unbalanced tags (unclosed {output['unclosed']}, stray {output['stray_end_tags']}), output may be truncated",
+            'Return the complete text and close every HTML tag you open.'))
+    if output['loose_text'] > source['loose_text']:
+        problems.append(StructureProblem(
+            'text outside the HTML blocks',
+            'Do not add any text before, after or between the HTML blocks.'))
+    if output['blocks'] != source['blocks']:
+        problems.append(StructureProblem(
+            f"{output['blocks']} blocks instead of {source['blocks']}",
+            f"Return exactly {source['blocks']} top-level HTML blocks, one for each block of the input, in the same order."))
+    if output['headings'] != source['headings']:
+        problems.append(StructureProblem(
+            f"heading sequence {output['headings']} instead of {source['headings']}",
+            f"Keep the headings of the input in the same order and at the same levels: {', '.join(source['headings']) or 'none'}."))
+    if output['lists'] != source['lists']:
+        problems.append(StructureProblem(
+            'list nesting changed',
+            'Keep every list and nested list exactly as in the input, with the same list type and nesting.'))
+
+    source_placeholders = Counter(source['placeholders'])
+    output_placeholders = Counter(output['placeholders'])
+    if source_placeholders != output_placeholders:
+        missing = sorted(source_placeholders - output_placeholders)
+        extra = output_placeholders - source_placeholders
+        added = sorted(placeholder for placeholder in extra if placeholder not in source_placeholders)
+        duplicated = sorted(placeholder for placeholder in extra if placeholder in source_placeholders)
+        problems.append(StructureProblem(
+            f"image placeholders changed (missing {missing}, added {added}, duplicated {duplicated})",
+            'Keep every image placeholder exactly as written and exactly once, in the same place: '
+            f"{', '.join(source['placeholders']) or 'there are none, do not add any'}."))
+
+    return problems
@@ -0,0 +1,219 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# On-demand profiling for the lambda handlers.
+#
+# Profiling is turned on for every invocation with the PROFILE_HANDLER=true environment variable,
+# or for a single invocation with "profile": true in the event. When it is on, the handler runs
+# under cProfile and every named stage records its wall time and a tracemalloc snapshot. The
+# profile (.prof, readable with pstats / snakeviz) and a JSON stage report are written to
+# PROFILE_OUTPUT, a local directory or an s3://bucket/prefix location, and a top-N summary is
+# printed to the logs. When it is off, handlers and stages run unwrapped.
+#
+# tracemalloc is process-wide, so memory figures are only recorded for stages that did not overlap
+# another stage (e.g. documents processed concurrently in batch mode); overlapping stages only
+# record their timing and are flagged in the report. Stages run inside document(key) are labelled
+# with that document, so the stages of a batch can be told apart.
+#
+# This module is shipped in the lambda layer (see the Dockerfile) and shared by the functions.
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import boto3
+
+PROFILE_ENABLED = os.environ.get('PROFILE_HANDLER', 'false').lower() == 'true'
+PROFILE_OUTPUT = os.environ.get('PROFILE_OUTPUT', '/tmp/profiles')
+PROFILE_TOP_N = int(os.environ.get('PROFILE_TOP_N', '20'))
+
+# Shared no-op context returned by stage() when profiling is off
+_NO_PROFILING = nullcontext()
+
+# The profiling session of the invocation in progress, if any
+_session = None
+
+# The document each thread is working on, set by document()
+_current = threading.local()
+
+
+class _ProfilingSession:
+    """Collects stage timings and memory snapshots for one handler invocation."""
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.lock = threading.Lock()
+        self.profiler = cProfile.Profile()
+        self.thread_id = threading.get_ident()
+        # cProfile only sees the thread it is enabled on, worker threads get one profiler per stage
+        self.thread_profilers = []
+        # Stages currently running, and whether any two stages ever ran at the same time
+        self.active_stages = set()
+        self.stages_overlapped = False
+
+    def stage(self, stage_name):
+        return _Stage(self, stage_name)
+
+    def start_stage(self, stage):
+        """Register a running stage, taking its memory baseline if no other stage is running."""
+        with self.lock:
+            if self.active_stages:
+                # Process-wide memory figures would mix the allocations of both stages
+                self.stages_overlapped = True
+                for active in self.active_stages:
+                    active.overlapped = True
+                stage.overlapped = True
+            else:
+                stage.before = tracemalloc.take_snapshot()
+                tracemalloc.reset_peak()
+            self.active_stages.add(stage)
+
+    def finish_stage(self, stage, elapsed):
+        """Record a finished stage, with memory figures only if it ran on its own."""
+        with self.lock:
+            self.active_stages.discard(stage)
+            stage_info = {
+                'stage': stage.stage_name,
+                'document': stage.document,
+                'thread': threading.current_thread().name,
+                'seconds': round(elapsed, 4),
+                'memory_per_stage': not stage.overlapped
+            }
+            if not stage.overlapped:
+                current, peak = tracemalloc.get_traced_memory()
+                after = tracemalloc.take_snapshot()
+                stage_info.update({
+                    'memory_current_bytes': current,
+                    'memory_peak_bytes': peak,
+                    'top_allocations': [str(stat) for stat in after.compare_to(stage.before, 'lineno')[:PROFILE_TOP_N]]
+                })
+            self.stages.append(stage_info)
+
+
+class _Stage:
+    """Context manager timing one named stage and diffing tracemalloc around it."""
+
+    def __init__(self, session, stage_name):
+        self.session = session
+        self.stage_name = stage_name
+        self.document = getattr(_current, 'document', None)
+        self.before = None
+        self.overlapped = False
+
+    def __enter__(self):
+        self.session.start_stage(self)
+        self.profiler = None
+        if threading.get_ident() != self.session.thread_id:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            with self.session.lock:
+                self.session.thread_profilers.append(self.profiler)
+        self.session.finish_stage(self, elapsed)
+        return False
+
+
+def stage(stage_name):
+    """Mark a named stage of the handler. A shared no-op when profiling is off."""
+    if _session is None:
+        return _NO_PROFILING
+    return _session.stage(stage_name)
+
+
+@contextmanager
+def document(document_key):
+    """Label the stages run by this thread inside the block with the document they work on."""
+    previous = getattr(_current, 'document', None)
+    _current.document = document_key
+    try:
+        yield
+    finally:
+        _current.document = previous
+
+
+def profiled(name):
+    """Decorate a lambda handler so it can be profiled on demand."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not (PROFILE_ENABLED or (isinstance(event, dict) and event.get('profile'))):
+                return handler(event, context)
+            return _run_profiled(name, handler, event, context)
+        return wrapper
+    return decorator
+
+
+def _run_profiled(name, handler, event, context):
+    global _session
+    session = _ProfilingSession(name)
+    _session = session
+    tracemalloc.start()
+    session.profiler.enable()
+    try:
+        return handler(event, context)
+    finally:
+        session.profiler.disable()
+        _session = None
+        tracemalloc.stop()
+        try:
+            _write_report(session, getattr(context, 'aws_request_id', None) or str(int(time.time())))
+        except Exception as e:
+            print(f'Could not write profile for {name}: {str(e)}')
+
+
+def _write_report(session, request_id):
+    """Log a summary of the session and save the profile and stage report to PROFILE_OUTPUT."""
+    summary = io.StringIO()
+    stats = pstats.Stats(session.profiler, stream=summary)
+    for profiler in session.thread_profilers:
+        stats.add(profiler)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+    print(f'Profile of {session.name} ({request_id}), top {PROFILE_TOP_N} by cumulative time:')
+    print(summary.getvalue())
+    if session.stages_overlapped:
+        print('Stages ran concurrently, memory figures are only given for stages that ran on their own')
+    for stage_info in session.stages:
+        memory = (f"peak memory {stage_info['memory_peak_bytes']} bytes" if stage_info['memory_per_stage']
+                  else 'memory not measured (overlapped another stage)')
+        label = ', '.join(part for part in (stage_info['document'], stage_info['thread']) if part)
+        print(f"Stage {stage_info['stage']} [{label}]: {stage_info['seconds']}s, {memory}")
+
+    base_name = f'{session.name}-{request_id}'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profile_path = os.path.join(tmp_dir, f'{base_name}.prof')
+        stages_path = os.path.join(tmp_dir, f'{base_name}-stages.json')
+        stats.dump_stats(profile_path)
+        with open(stages_path, 'w') as f:
+            json.dump({
+                'memory_per_stage_accurate': not session.stages_overlapped,
+                'stages': session.stages
+            }, f, indent=2)
+
+        if PROFILE_OUTPUT.startswith('s3://'):
+            bucket, _, prefix = PROFILE_OUTPUT[len('s3://'):].partition('/')
+            s3 = boto3.client('s3')
+            for path in (profile_path, stages_path):
+                key = '/'.join(part for part in (prefix.strip('/'), os.path.basename(path)) if part)
+                s3.upload_file(path, bucket, key)
+        else:
+            os.makedirs(PROFILE_OUTPUT, exist_ok=True)
+            for path in (profile_path, stages_path):
+                shutil.move(path, os.path.join(PROFILE_OUTPUT, os.path.basename(path)))
+
+    print(f'Profile written to {PROFILE_OUTPUT}/{base_name}.prof')
@@ -2,10 +2,12 @@
 # SPDX-License-Identifier: MIT-0
 
 import boto3
+import hashlib
 import os
 import json
 import docx
 import tempfile
+from profiling import profiled, stage
 
 s3 = boto3.client('s3')
 translate = boto3.client('translate')
@@ -31,6 +33,36 @@ def determine_language(key):
             return folder
     return None
 
+# Per-document manifests of translated paragraphs, stored in the output bucket
+MANIFEST_PREFIX = 'manifests/translate/'
+
+def load_translation_manifest(bucket_name, manifest_key):
+    """Load the paragraph hash -> translation map of the previous run, or an empty one."""
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=manifest_key)
+        return json.loads(response['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return {}
+    except Exception as e:
+        print(f'Could not load manifest {manifest_key}: {str(e)}')
+        return {}
+
+def save_translation_manifest(bucket_name, manifest_key, translations):
+    try:
+        s3.put_object(Bucket=bucket_name, Key=manifest_key, Body=json.dumps(translations).encode('utf-8'),
+                      ContentType='application/json')
+    except Exception as e:
+        print(f'Could not save manifest {manifest_key}: {str(e)}')
+
+def translate_cached(text, source_language, target_language, previous, translations):
+    """Translate text, reusing the translation from the previous run if the text is unchanged."""
+    key = hashlib.sha256(f'{source_language}:{target_language}:{text}'.encode('utf-8')).hexdigest()
+    translated_text = previous.get(key)
+    if translated_text is None:
+        translated_text = translate_text(text, source_language, target_language)
+    translations[key] = translated_text
+    return translated_text
+
 def translate_text(text, source_language, target_language):
     response = translate.translate_text(
         Text=text,
@@ -40,6 +72,7 @@ def translate_text(text, source_language, target_language):
     return response['TranslatedText']
 
 
+@profiled('translate')
 def handler(event, context):
     try: 
         bucket_name = event['documentPath']
@@ -60,6 +93,12 @@ def handler(event, context):
         
         language_code = document_key.split('/')[0]  
 
+        # Translations from the previous upload of this document
+        output_bucket = os.environ['OUTPUT_BUCKET']
+        manifest_key = f'{MANIFEST_PREFIX}{document_key}.json'
+        previous_translations = load_translation_manifest(output_bucket, manifest_key)
+        translations = {}
+
         path_dict = {
                 'name': original_filename,  
                 'path': document_key,
@@ -79,42 +118,48 @@ def handler(event, context):
             with tempfile.NamedTemporaryFile(delete=False,  suffix='.docx') as temp_file:
                 download_path = temp_file.name
             
-            s3.download_file(bucket_name, document_key, download_path)
-
-            # Load the DOCX file
-            doc = docx.Document(download_path)
-
-            # Translate text in paragraphs
-            for paragraph in doc.paragraphs:
-                if paragraph.text:
-                    translated_text = translate_text(paragraph.text, source_language_code, target_language_code)
-                    paragraph.text = translated_text
-
-            # Translate text in tables
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for paragraph in cell.paragraphs:
-                            if paragraph.text:
-                                translated_text = translate_text(paragraph.text, source_language_code, target_language_code)
-                                paragraph.text = translated_text
+            with stage('download'):
+                s3.download_file(bucket_name, document_key, download_path)
+
+                # Load the DOCX file
+                doc = docx.Document(download_path)
+
+            with stage(f'translate_{target_folder}'):
+                # Translate text in paragraphs
+                for paragraph in doc.paragraphs:
+                    if paragraph.text:
+                        translated_text = translate_cached(paragraph.text, source_language_code, target_language_code,
+                                                           previous_translations, translations)
+                        paragraph.text = translated_text
+
+                # Translate text in tables
+                for table in doc.tables:
+                    for row in table.rows:
+                        for cell in row.cells:
+                            for paragraph in cell.paragraphs:
+                                if paragraph.text:
+                                    translated_text = translate_cached(paragraph.text, source_language_code, target_language_code,
+                                                                       previous_translations, translations)
+                                    paragraph.text = translated_text
 
             # Save the translated document
             with tempfile.NamedTemporaryFile(delete=False,  suffix='.docx') as temp_translated:
                 translated_path = temp_translated.name
 
-            doc.save(translated_path)
+            with stage('save'):
+                doc.save(translated_path)
 
 
             # Upload the translated document to the input bucket under the translaed path
             original_filename_without_doctype = original_filename.split('.')[0]
             target_key = f'{target_folder}/{original_filename_without_doctype}_{language_code}_to_{target_folder}_translated.docx' # matches the exempted prefix in the s3EventRule
             input_bucket = os.environ['INPUT_BUCKET']
-            s3.upload_file(
-                translated_path, 
-                input_bucket, 
-                target_key
-            )
+            with stage('upload'):
+                s3.upload_file(
+                    translated_path, 
+                    input_bucket, 
+                    target_key
+                )
             
             path_dict = {
                 'name': f'{original_filename_without_doctype}_{language_code}_to_{target_folder}_translated.docx',  
@@ -130,6 +175,10 @@ def handler(event, context):
 
         print(f"Successfully processed and translated {target_key}")
 
+        reused = sum(1 for key in translations if key in previous_translations)
+        print(f"Reused {reused} of {len(translations)} paragraph translations from the previous run")
+        save_translation_manifest(output_bucket, manifest_key, translations)
+
 
 
         return {
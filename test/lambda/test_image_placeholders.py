@@ -0,0 +1,47 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'lambda', 'bedrock'))
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'lambda', 'shared'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from docx import Document  # noqa: E402
+
+import bedrock_processor  # noqa: E402
+
+IMAGE = os.path.join(ROOT, 'pictures', 'english.png')
+
+
+def test_image_left_for_mammoth_becomes_a_placeholder_that_is_reinserted(tmp_path):
+    # An image extraction did not reach, numbered after the two body images it did replace
+    source = Document()
+    source.add_paragraph('Before the image.')
+    source.add_picture(IMAGE)
+    source_path = str(tmp_path / 'source.docx')
+    source.save(source_path)
+    images_info = [
+        {'placeholder': '[IMAGE_1]', 'image_path': IMAGE, 'rel_id': 'rId1'},
+        {'placeholder': '[IMAGE_2]', 'image_path': IMAGE, 'rel_id': 'rId1'},
+    ]
+
+    html_content = bedrock_processor.docx_to_html(source_path, images_info, str(tmp_path))
+
+    assert '<img' not in html_content
+    assert '[IMAGE_3]' in html_content
+    assert images_info[2]['placeholder'] == '[IMAGE_3]'
+    with open(images_info[2]['image_path'], 'rb') as saved, open(IMAGE, 'rb') as original:
+        assert saved.read() == original.read()
+
+    template_path = str(tmp_path / 'template.docx')
+    Document().save(template_path)
+    output_path = str(tmp_path / 'output.docx')
+    bedrock_processor.load_template_and_add_html_content(template_path, output_path, html_content)
+    bedrock_processor.reinsert_images(output_path, images_info[2:])
+
+    output = Document(output_path)
+    assert len(output.inline_shapes) == 1
+    assert '[IMAGE_3]' not in '\n'.join(paragraph.text for paragraph in output.paragraphs)
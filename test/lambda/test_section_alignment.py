@@ -0,0 +1,82 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'lambda', 'bedrock'))
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'lambda', 'shared'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import bedrock_processor  # noqa: E402
+from section_cache import split_sections, split_like  # noqa: E402
+from structure_verifier import verify_structure  # noqa: E402
+
+
+PARAGRAPHS = [
+    f'<p>Paragraph {i} of the policy explains teh rules for team number {i} in some detail.</p>'
+    for i in range(60)
+]
+
+
+def _correct_and_merge_first_two(html_content):
+    """Stub model output: fixes a typo everywhere and merges the first two paragraphs."""
+    corrected = html_content.replace('teh', 'the')
+    return corrected.replace('</p><p>Paragraph 1 ', ' Paragraph 1 ', 1)
+
+
+def _prompt_text(model_prompt):
+    return model_prompt.split('Here is the text:\n\n    ')[1].split('\n    \n    \n\nAssistant')[0]
+
+
+class _FakeS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = Body
+
+
+def test_split_like_keeps_sections_aligned_after_a_merged_block():
+    html_content = ''.join(PARAGRAPHS)
+    sections = split_sections(html_content)
+    assert len(sections) > 10
+
+    pieces = split_like(_correct_and_merge_first_two(html_content), sections)
+
+    assert len(pieces) == len(sections)
+    failing = [k for k, (section, piece) in enumerate(zip(sections, pieces)) if verify_structure(section, piece)]
+    assert failing == [0]
+
+
+def test_merged_block_only_re_requests_its_own_section(monkeypatch):
+    monkeypatch.setenv('OUTPUT_BUCKET', 'output')
+    monkeypatch.setattr(bedrock_processor, 's3_client', _FakeS3())
+    prompts = []
+
+    def invoke(model_prompt):
+        prompts.append(model_prompt)
+        text = _prompt_text(model_prompt)
+        # Only the first, whole-document request merges paragraphs
+        return _correct_and_merge_first_two(text) if len(prompts) == 1 else text.replace('teh', 'the')
+
+    monkeypatch.setattr(bedrock_processor, 'invoke_bedrock_model', invoke)
+
+    corrected, verification = bedrock_processor.correct_html_incrementally('english/doc.docx', ''.join(PARAGRAPHS))
+
+    assert verification['retries'] == 1
+    assert verification['failed'] == 0
+    assert len(prompts) == 2
+    assert 'teh' not in corrected
+    assert corrected.count('<p>') == len(PARAGRAPHS)